@@ -28,20 +28,12 @@ def main():
 
     reactors = [r for r in REACTORS_DEFAULT]
 
-    pids = {}
-    for r in reactors:
-        if args.mode == "co2_only":
-            pids[r.name] = PID(PID_KP, PID_KI, PID_KD, 0.0, CO2_MAX)
-        else:
-            pids[r.name] = PID(PID_KP, PID_KI, PID_KD, -100.0, CO2_MAX)
-
-    co2_cmd = {r.name: 0.0 for r in reactors}
-    air_cmd = {r.name: r.air_baseline for r in reactors}
-
-    last_ph_time = {r.name: 0.0 for r in reactors}
-    last_co2_flow = {r.name: None for r in reactors}
+    if args.mode == "co2_only":
+        rstate = ReactorState(reactors, PID_KP, PID_KI, PID_KD, 0.0, CO2_MAX)
+    else:
+        rstate = ReactorState(reactors, PID_KP, PID_KI, PID_KD, -100.0, CO2_MAX)
 
-    alarms = set()
+    alarms = AlarmSet()
     state = S_INIT
 
     mm44_list = []
@@ -51,8 +43,17 @@ def main():
     air_mfc = {}
     co2_mfc = {}
 
+    flow_futures = {}
+    last_written_co2 = {}
+    last_written_air = {}
+    last_mfc_refresh = 0.0
+
     show_raw = args.raw
-    last_t = time.time()
+    # Monotonic clock for loop timing and staleness: immune to NTP
+    # steps that would otherwise spike dt and poison the integrators.
+    last_t = time.monotonic()
+    next_tick = time.monotonic()
+    last_dashboard_hash = None
 
     log_enabled = args.log_enable
     last_log_ts = 0.0
@@ -66,13 +67,14 @@ def main():
 
     try:
         while True:
-            now = time.time()
+            now = time.monotonic()
             dt = max(now - last_t, 0.01)
             last_t = now
 
             # ---------- INIT ----------
             if state == S_INIT:
                 alarms.clear()
+                reset_mapping_cache()
 
                 mm44_list, ok_mm44 = open_mm44_all(mm44_ports)
                 if not ok_mm44:
@@ -88,23 +90,21 @@ def main():
                     except Exception:
                         alarms.add("MFC_INIT_FAIL")
 
+                    start_mfc_worker()
+
                 if alarms:
                     state = S_FAILSAFE
                 else:
+                    rstate.reset_pid_all()
                     state = S_RUN
 
             # ---------- Read MM44 ----------
-            for idx, ser in enumerate(mm44_list):
-                for _ in range(6):
-                    try:
-                        raw = ser.readline().decode(errors="ignore").strip()
-                    except Exception:
-                        alarms.add("MM44_READ_FAIL")
-                        break
-
-                    if not raw:
-                        break
+            mm44_lines, ok_read = read_mm44_all(mm44_list)
+            if not ok_read:
+                alarms.add("MM44_READ_FAIL")
 
+            for idx, lines in mm44_lines.items():
+                for raw in lines:
                     last_mm44_raw[idx] = raw
                     if show_raw:
                         print(f"RAW[{idx}]: {raw}")
@@ -113,130 +113,212 @@ def main():
                     if parsed:
                         mm44_data.setdefault(idx, {}).update(parsed)
 
-            validate_mapping(mm44_data, reactors, alarms)
+            # ---------- Channel lookup (once per tick) ----------
+            blocks = {
+                r.name: (
+                    get_channel(mm44_data, r.ph_mm44, r.ph_ch),
+                    get_channel(mm44_data, r.do_mm44, r.do_ch),
+                )
+                for r in reactors
+            }
+
+            validate_mapping(mm44_data, reactors, alarms, blocks)
 
             # ---------- Build reactor values ----------
             reactor_values = {}
 
-            for r in reactors:
-                ph_block = get_channel(mm44_data, r.ph_mm44, r.ph_ch)
+            for i, r in enumerate(reactors):
+                ph_block = blocks[r.name][0]
                 ph = ph_block.get("value") if ph_block else None
+                rstate.ph[i] = ph
 
                 if ph is not None and 0.0 <= ph <= 14.0:
-                    last_ph_time[r.name] = time.time()
+                    rstate.last_ph_time[i] = time.monotonic()
 
                 reactor_values[r.name] = {
                     "enabled": r.enabled,
                     "pH": ph,
                     "ph_sp": r.ph_sp,
                     "air_baseline": r.air_baseline,
-                    "air_cmd": air_cmd[r.name],
-                    "co2_cmd": co2_cmd[r.name],
+                    "air_cmd": rstate.air_cmd[i],
+                    "co2_cmd": rstate.co2_cmd[i],
                 }
 
             # ---------- Stale detection ----------
-            for r in reactors:
-                key = f"{r.name}_PH_STALE"
-                if last_ph_time[r.name] and (time.time() - last_ph_time[r.name]) > MM44_STALE_SEC:
-                    alarms.add(key)
+            for i, r in enumerate(reactors):
+                rstate.stale[i] = bool(
+                    rstate.last_ph_time[i]
+                    and (time.monotonic() - rstate.last_ph_time[i]) > MM44_STALE_SEC
+                )
+                if rstate.stale[i]:
+                    alarms.add(r.ph_stale_key)
                 else:
-                    alarms.discard(key)
+                    alarms.discard(r.ph_stale_key)
 
             # ---------- Control ----------
             if state == S_RUN:
-                for r in reactors:
-                    if not r.enabled or f"{r.name}_PH_STALE" in alarms:
+                # Harvest last tick's flow readbacks; the bus worker
+                # completed them while this thread was sleeping.
+                for i in list(flow_futures):
+                    if flow_futures[i].done():
+                        flow, _ = flow_futures[i].result()
+                        rstate.co2_flow[i] = flow
+                        del flow_futures[i]
+
+                if pop_mfc_worker_error() is not None:
+                    alarms.add("MFC_WRITE_FAIL")
+                    # A write may not have reached the device; drop the
+                    # dedup cache so the next tick rewrites everything.
+                    last_written_co2.clear()
+                    last_written_air.clear()
+                else:
+                    alarms.discard("MFC_WRITE_FAIL")
+
+                force_mfc = (now - last_mfc_refresh) >= MFC_REFRESH_S
+                if force_mfc:
+                    last_mfc_refresh = now
+
+                # All per-reactor control math in one fused pass;
+                # the loop below is left with I/O decisions only.
+                run_step(
+                    rstate.ph, rstate.sp, rstate.enabled, rstate.stale,
+                    args.deadband, args.mode == "split",
+                    rstate.kp, rstate.ki, rstate.kd, rstate.kt,
+                    rstate.out_min, rstate.out_max,
+                    rstate.air_baseline,
+                    rstate.integrator, rstate.prev_err, rstate.has_prev,
+                    rstate.co2_cmd, rstate.air_cmd,
+                    CO2_RATE_LIMIT_PER_S * dt, AIR_RATE_LIMIT_PER_S * dt, dt,
+                    CO2_MIN, CO2_MAX, AIR_MIN, AIR_MAX,
+                )
+
+                for i, r in enumerate(reactors):
+                    if not r.enabled or rstate.stale[i]:
                         apply_safe_outputs_for_reactor(
-                            r, co2_cmd, air_cmd, air_mfc, co2_mfc, args.no_mfc
+                            r, rstate, air_mfc, co2_mfc, args.no_mfc
                         )
+                        last_written_co2.pop(i, None)
+                        last_written_air.pop(i, None)
                         continue
 
-                    ph = reactor_values[r.name]["pH"]
-                    if ph is None:
+                    if rstate.ph[i] is None:
                         continue
 
-                    if abs(ph - r.ph_sp) <= args.deadband:
-                        control_signal = 0.0
-                    else:
-                        control_signal = pids[r.name].update(ph, r.ph_sp, dt)
-
-                    if args.mode == "co2_only" or control_signal >= 0:
-                        target_co2 = clamp(control_signal, CO2_MIN, CO2_MAX)
-                        target_air = r.air_baseline
-                    else:
-                        target_co2 = 0.0
-                        target_air = clamp_air(r.air_baseline + abs(control_signal))
-
-                    co2_cmd[r.name] = rate_limit(
-                        target_co2, co2_cmd[r.name], CO2_RATE_LIMIT_PER_S * dt
-                    )
-                    air_cmd[r.name] = rate_limit(
-                        target_air, air_cmd[r.name], AIR_RATE_LIMIT_PER_S * dt
-                    )
-
                     if not args.no_mfc:
-                        mfc_try(write_f32, co2_mfc[r.name], REG_VALVE_CMD, co2_cmd[r.name])
-                        mfc_try(write_f32, air_mfc[r.name], REG_VALVE_CMD, air_cmd[r.name])
-                        flow, _ = mfc_try(read_f32, co2_mfc[r.name], REG_FLOW_ACTUAL)
-                        last_co2_flow[r.name] = flow
+                        # In steady state the rate limiter often lands on
+                        # the same value as last tick; skip the ~10 ms bus
+                        # transaction unless the command actually moved.
+                        co2_v = rstate.co2_cmd[i]
+                        prev = last_written_co2.get(i)
+                        if force_mfc or prev is None or abs(co2_v - prev) > MFC_WRITE_EPS:
+                            submit_mfc(write_f32, co2_mfc[r.name], REG_VALVE_CMD, co2_v)
+                            last_written_co2[i] = co2_v
+
+                        air_v = rstate.air_cmd[i]
+                        prev = last_written_air.get(i)
+                        if force_mfc or prev is None or abs(air_v - prev) > MFC_WRITE_EPS:
+                            submit_mfc(write_f32, air_mfc[r.name], REG_VALVE_CMD, air_v)
+                            last_written_air[i] = air_v
+
+                        if i not in flow_futures:
+                            flow_futures[i] = submit_mfc(
+                                read_f32, co2_mfc[r.name], REG_FLOW_ACTUAL,
+                                want_result=True
+                            )
 
             # ---------- Dashboard ----------
             try:
-                with open(MM44_LATEST_JSON, "w") as f:
-                    json.dump({
-                        "ts": now_iso(),
-                        "state": state,
-                        "alarms": sorted(list(alarms)),
-                        "reactors": reactor_values,
-                    }, f)
+                payload = dumps_bytes({
+                    "ts": now_iso(),
+                    "state": state,
+                    "alarms": alarms.sorted_list(),
+                    "reactors": reactor_values,
+                })
+
+                # Write via temp file + rename so a dashboard reader
+                # never sees a torn file, and skip the write entirely
+                # when nothing changed since the previous tick.
+                h = hash(payload)
+                if h != last_dashboard_hash:
+                    tmp = MM44_LATEST_JSON + ".tmp"
+                    with open(tmp, "wb") as f:
+                        f.write(payload)
+                    os.replace(tmp, MM44_LATEST_JSON)
+                    last_dashboard_hash = h
             except Exception:
                 pass
 
             # ---------- Logging ----------
-            if log_enabled and (time.time() - last_log_ts) >= args.log_interval:
-                last_log_ts = time.time()
-                purge_old_logs(args.log_dir, datetime.now(), args.log_retention_days)
+            if log_enabled and (now - last_log_ts) >= args.log_interval:
+                last_log_ts = now
+
+                # One wall-clock sample per log step, shared by the
+                # purge, the minute tag, the row timestamps and the
+                # log-path helper.
+                dt_now = datetime.now()
+                purge_old_logs(args.log_dir, dt_now, args.log_retention_days)
 
                 header = [
                     "timestamp", "reactor", "state", "enabled",
                     "pH", "ph_sp", "air_cmd", "co2_cmd", "alarms"
                 ]
 
-                minute_tag = datetime.now().strftime("%Y-%m-%d %H:%M")
-                for r in reactors:
+                minute_tag = dt_now.strftime("%Y-%m-%d %H:%M")
+                for i, r in enumerate(reactors):
                     if last_logged_minute[r.name] == minute_tag:
                         continue
                     last_logged_minute[r.name] = minute_tag
 
                     row = {
-                        "timestamp": now_iso(),
+                        "timestamp": dt_now.isoformat(timespec="seconds"),
                         "reactor": r.name,
                         "state": state,
                         "enabled": r.enabled,
-                        "pH": reactor_values[r.name]["pH"],
+                        "pH": rstate.ph[i],
                         "ph_sp": r.ph_sp,
-                        "air_cmd": air_cmd[r.name],
-                        "co2_cmd": co2_cmd[r.name],
-                        "alarms": ",".join(sorted(alarms)),
+                        "air_cmd": rstate.air_cmd[i],
+                        "co2_cmd": rstate.co2_cmd[i],
+                        "alarms": alarms.joined(),
                     }
-                    append_csv_row(
-                        reactor_log_path(args.log_dir, r.name, datetime.now()),
-                        header, row
-                    )
-
-            time.sleep(args.dt)
+                    writer = get_csv_writer(args.log_dir, r.name, dt_now, header)
+                    writer.writerow(row)
+
+                flush_csv_all()
+
+            # Deadline scheduler: sleep to the next absolute deadline
+            # so the loop period stays args.dt regardless of how long
+            # this tick's work took, instead of args.dt + work_time.
+            next_tick += args.dt
+            sleep_s = next_tick - time.monotonic()
+            if sleep_s < -args.dt:
+                # More than a full period behind: resynchronize rather
+                # than bursting catch-up ticks.
+                alarms.add("LOOP_OVERRUN")
+                next_tick = time.monotonic()
+            else:
+                alarms.discard("LOOP_OVERRUN")
+            time.sleep(max(0.0, sleep_s))
 
     except KeyboardInterrupt:
         print("\nStopping controller (safe shutdown)")
 
     finally:
-        for r in reactors:
-            try:
-                if r.name in co2_mfc:
-                    write_f32(co2_mfc[r.name], REG_VALVE_CMD, 0.0)
-            except Exception:
-                pass
+        # Stop the bus worker first, dropping any backlog: the final
+        # CO₂-zero writes must not queue behind (or interleave with)
+        # stale transactions, and the direct writes below may only run
+        # once the worker can no longer be mid-transaction.
+        if stop_mfc_worker():
+            for r in reactors:
+                try:
+                    if r.name in co2_mfc:
+                        write_f32(co2_mfc[r.name], REG_VALVE_CMD, 0.0)
+                except Exception:
+                    pass
+            close_mfc_all()
+        else:
+            print("[MFC] worker did not stop; leaving port to it")
 
+        close_csv_all()
         close_mm44_all(mm44_list)
         print("Shutdown complete")
 
@@ -2,38 +2,82 @@
 # MFC (Modbus RTU) helpers
 # ============================================================
 
+# One Instrument per (port, addr), shared for the process lifetime.
+# Keeping the port open avoids a termios reconfigure + settle delay
+# on every transaction, which dominates at 9600 baud.
+_mfc_cache = {}
+
+# Precompiled packers: skip format-string parsing on every transaction.
+_F32 = struct.Struct(">f")
+_HH = struct.Struct(">HH")
+
 def make_mfc(port, addr):
-    """Create and configure a Modbus RTU instrument for an MFC."""
+    """Create (or reuse) a Modbus RTU instrument for an MFC."""
+    key = (port, addr)
+    inst = _mfc_cache.get(key)
+    if inst is not None:
+        return inst
+
     inst = minimalmodbus.Instrument(port, addr, mode=minimalmodbus.MODE_RTU)
     inst.serial.baudrate = MFC_BAUD
     inst.serial.parity = serial.PARITY_NONE
     inst.serial.stopbits = 2
     inst.serial.bytesize = 8
     inst.serial.timeout = MFC_TIMEOUT
-    inst.clear_buffers_before_each_transaction = True
-    inst.close_port_after_each_call = True
+    inst.clear_buffers_before_each_transaction = False
+    inst.close_port_after_each_call = False
+
+    _mfc_cache[key] = inst
     return inst
 
+def close_mfc_all():
+    """Close every cached MFC serial port (shutdown path)."""
+    for inst in _mfc_cache.values():
+        try:
+            inst.serial.close()
+        except Exception:
+            pass
+    _mfc_cache.clear()
+
 def write_u16(inst, reg, value):
     inst.write_register(reg, int(value), 0, functioncode=6, signed=False)
 
 def read_f32(inst, reg):
     w0, w1 = inst.read_registers(reg, 2, functioncode=3)
     if WORD_ORDER == "hi_lo":
-        raw = struct.pack(">HH", w0, w1)
+        raw = _HH.pack(w0, w1)
     else:
-        raw = struct.pack(">HH", w1, w0)
-    return struct.unpack(">f", raw)[0]
+        raw = _HH.pack(w1, w0)
+    return _F32.unpack(raw)[0]
 
 def write_f32(inst, reg, value):
-    raw = struct.pack(">f", float(value))
-    hi, lo = struct.unpack(">HH", raw)
+    hi, lo = _HH.unpack(_F32.pack(float(value)))
     if WORD_ORDER == "hi_lo":
         inst.write_registers(reg, [hi, lo])
     else:
         inst.write_registers(reg, [lo, hi])
 
-def mfc_try(op, *args, retries=3, delay=0.05):
+def write_f32_block(inst, reg, values):
+    """
+    Write N consecutive floats in one FC16 transaction.
+    One bus round-trip instead of N, for setpoints that live in
+    adjacent register pairs on the same slave.
+    """
+    words = []
+    for value in values:
+        hi, lo = _HH.unpack(_F32.pack(float(value)))
+        if WORD_ORDER == "hi_lo":
+            words.extend((hi, lo))
+        else:
+            words.extend((lo, hi))
+    inst.write_registers(reg, words)
+
+# Retry back-off scaled to the bus rate: ~3 character times at the
+# configured baud, floored at 3 ms. A fixed 50 ms stalled the loop
+# far longer than the line needs to go idle.
+MFC_RETRY_DELAY = max(0.003, 30.0 / MFC_BAUD)
+
+def mfc_try(op, *args, retries=3, delay=MFC_RETRY_DELAY):
     """
     Execute a Modbus operation with retries.
     Returns (result, error).
@@ -47,30 +91,188 @@ def mfc_try(op, *args, retries=3, delay=0.05):
             time.sleep(delay)
     return None, last_err
 
+# ============================================================
+# MFC transaction worker
+# ============================================================
+
+# A single worker thread owns the RS-485 bus and executes queued
+# transactions in order. The control thread enqueues writes without
+# waiting and only collects futures for readbacks, so Python-side
+# work overlaps with bus time instead of serializing behind it.
+_mfc_queue = None
+_mfc_thread = None
+
+# Last error from a fire-and-forget write, surfaced lazily.
+_mfc_worker_err = [None]
+
+# Set during shutdown: the worker drops queued ops without touching
+# the bus, so a backed-up queue cannot outlive the stop request.
+_mfc_stopping = [False]
+
+def _mfc_worker():
+    while True:
+        item = _mfc_queue.get()
+        if item is None:
+            break
+        op, args, future = item
+        if _mfc_stopping[0]:
+            if future is not None:
+                future.set_result((None, RuntimeError("MFC worker stopping")))
+            continue
+        result, err = mfc_try(op, *args)
+        if future is not None:
+            future.set_result((result, err))
+        elif err is not None:
+            _mfc_worker_err[0] = err
+
+def start_mfc_worker():
+    """Start the bus worker thread (idempotent)."""
+    global _mfc_queue, _mfc_thread
+    if _mfc_thread is not None and _mfc_thread.is_alive():
+        return
+    _mfc_stopping[0] = False
+    _mfc_queue = queue.SimpleQueue()
+    _mfc_thread = threading.Thread(target=_mfc_worker, name="mfc-bus", daemon=True)
+    _mfc_thread.start()
+
+def stop_mfc_worker():
+    """
+    Stop the bus worker, dropping queued work (shutdown path).
+    Returns True when the worker is confirmed stopped and the caller
+    may transact on the port directly; False if it is still running
+    (at worst finishing one in-flight transaction's retries).
+    """
+    global _mfc_thread
+    if _mfc_thread is not None and _mfc_thread.is_alive():
+        _mfc_stopping[0] = True
+        _mfc_queue.put(None)
+        _mfc_thread.join(timeout=5.0)
+        if _mfc_thread.is_alive():
+            return False
+    _mfc_thread = None
+    _mfc_stopping[0] = False
+    return True
+
+def submit_mfc(op, *args, want_result=False):
+    """
+    Queue a Modbus operation for the bus worker.
+    Returns a Future resolving to (result, error) when want_result is
+    set, else None. With no worker running (startup/shutdown paths)
+    the operation executes inline instead.
+    """
+    if _mfc_thread is None or not _mfc_thread.is_alive():
+        result, err = mfc_try(op, *args)
+        if not want_result:
+            if err is not None:
+                _mfc_worker_err[0] = err
+            return None
+        future = concurrent.futures.Future()
+        future.set_result((result, err))
+        return future
+
+    future = concurrent.futures.Future() if want_result else None
+    _mfc_queue.put((op, args, future))
+    return future
+
+def pop_mfc_worker_error():
+    """Return and clear the last fire-and-forget write error, if any."""
+    err = _mfc_worker_err[0]
+    _mfc_worker_err[0] = None
+    return err
+
 # ============================================================
 # MM44 channel access helpers
 # ============================================================
 
 def get_channel(mm44_data, mm44_idx: int, ch: str):
+    # ch is normalized to upper case at configuration time
     dev = mm44_data.get(mm44_idx, {})
-    return dev.get(ch.upper())
+    return dev.get(ch)
+
+# ============================================================
+# Alarm set
+# ============================================================
+
+class AlarmSet(set):
+    """
+    Set of alarm keys that caches its sorted / comma-joined forms.
+    Alarms rarely change between ticks, so the dashboard JSON and the
+    CSV rows normally reuse the cached values instead of re-sorting
+    the set every pass.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._dirty = True
+        self._sorted = []
+        self._joined = ""
+
+    def add(self, key):
+        if key not in self:
+            self._dirty = True
+        super().add(key)
+
+    def discard(self, key):
+        if key in self:
+            self._dirty = True
+        super().discard(key)
+
+    def clear(self):
+        if self:
+            self._dirty = True
+        super().clear()
+
+    def _refresh(self):
+        self._sorted = sorted(self)
+        self._joined = ",".join(self._sorted)
+        self._dirty = False
+
+    def sorted_list(self):
+        if self._dirty:
+            self._refresh()
+        return self._sorted
+
+    def joined(self):
+        if self._dirty:
+            self._refresh()
+        return self._joined
 
 # ============================================================
 # Mapping validation
 # ============================================================
 
-def validate_mapping(mm44_data, reactors, alarms):
+# Last observed mapping signature per reactor. Validation is
+# re-evaluated only when the relevant mm44_data slots change.
+_last_map_sig = {}
+
+def reset_mapping_cache():
+    """Force full re-validation on the next pass (INIT / re-open path)."""
+    _last_map_sig.clear()
+
+def validate_mapping(mm44_data, reactors, alarms, blocks):
     """
     Ensure each reactor's mapped channels exist and match expected types.
     Raises alarms but does not crash the controller.
+    blocks is the per-tick {name: (ph_block, do_block)} lookup cache.
     """
     for r in reactors:
-        ph_block = get_channel(mm44_data, r.ph_mm44, r.ph_ch)
-        do_block = get_channel(mm44_data, r.do_mm44, r.do_ch)
+        ph_block, do_block = blocks[r.name]
+
+        sig = (
+            ph_block is None,
+            do_block is None,
+            r.ph_mm44 in mm44_data,
+            r.do_mm44 in mm44_data,
+            ph_block.get("type") if ph_block else None,
+            do_block.get("type") if do_block else None,
+        )
+        if _last_map_sig.get(r.name) == sig:
+            continue
+        _last_map_sig[r.name] = sig
 
         # ---- pH validation ----
-        ph_missing = f"MAP_CH_MISSING_{r.name}_PH"
-        ph_mismatch = f"MAP_TYPE_MISMATCH_{r.name}_PH"
+        ph_missing = r.ph_missing_key
+        ph_mismatch = r.ph_mismatch_key
 
         if ph_block is None:
             if r.ph_mm44 in mm44_data:
@@ -86,8 +288,8 @@ def validate_mapping(mm44_data, reactors, alarms):
                 alarms.discard(ph_mismatch)
 
         # ---- DO validation ----
-        do_missing = f"MAP_CH_MISSING_{r.name}_DO"
-        do_mismatch = f"MAP_TYPE_MISMATCH_{r.name}_DO"
+        do_missing = r.do_missing_key
+        do_mismatch = r.do_mismatch_key
 
         if do_block is None:
             if r.do_mm44 in mm44_data:
@@ -102,6 +304,60 @@ def validate_mapping(mm44_data, reactors, alarms):
             else:
                 alarms.discard(do_mismatch)
 
+# ============================================================
+# CSV logging helpers
+# ============================================================
+
+# Open daily log handles, one per reactor: {name: (date, writer, fh)}.
+# One open()/close() per day instead of per row.
+_csv_handles = {}
+
+def get_csv_writer(log_dir, reactor, dt_now, header):
+    """
+    Return a csv.DictWriter for this reactor's current daily log,
+    keeping the underlying file handle open across rows. Rotates the
+    handle when the day changes and writes the header when a new
+    file is started.
+    """
+    day = dt_now.date()
+    cached = _csv_handles.get(reactor)
+    if cached is not None:
+        cached_day, writer, fh = cached
+        if cached_day == day:
+            return writer
+        try:
+            fh.close()
+        except Exception:
+            pass
+
+    path = reactor_log_path(log_dir, reactor, dt_now)
+    is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+
+    fh = open(path, "a", buffering=1 << 16, newline="")
+    writer = csv.DictWriter(fh, fieldnames=header)
+    if is_new:
+        writer.writeheader()
+
+    _csv_handles[reactor] = (day, writer, fh)
+    return writer
+
+def flush_csv_all():
+    """Push buffered rows to disk (end of each log step)."""
+    for _, _, fh in _csv_handles.values():
+        try:
+            fh.flush()
+        except Exception:
+            pass
+
+def close_csv_all():
+    """Flush and close all cached log handles (shutdown path)."""
+    for _, _, fh in _csv_handles.values():
+        try:
+            fh.close()
+        except Exception:
+            pass
+    _csv_handles.clear()
+
 # ============================================================
 # State machine definitions
 # ============================================================
@@ -115,32 +371,33 @@ S_FAILSAFE = "FAILSAFE"
 # Safety output helpers
 # ============================================================
 
-def apply_safe_outputs_for_reactor(r, co2_cmd, air_cmd, air_mfc, co2_mfc, no_mfc):
+def apply_safe_outputs_for_reactor(r, rstate, air_mfc, co2_mfc, no_mfc):
     """
     Force a single reactor into a safe state.
     CO₂ -> 0
     AIR -> 0
     """
-    co2_cmd[r.name] = 0.0
-    air_cmd[r.name] = 0.0
+    i = rstate.index[r.name]
+    rstate.co2_cmd[i] = 0.0
+    rstate.air_cmd[i] = 0.0
 
     if no_mfc:
         return
 
     if r.name in co2_mfc:
-        mfc_try(write_f32, co2_mfc[r.name], REG_VALVE_CMD, 0.0)
+        submit_mfc(write_f32, co2_mfc[r.name], REG_VALVE_CMD, 0.0)
 
     if r.name in air_mfc:
-        mfc_try(write_f32, air_mfc[r.name], REG_VALVE_CMD, 0.0)
+        submit_mfc(write_f32, air_mfc[r.name], REG_VALVE_CMD, 0.0)
 
-def failsafe_outputs_all(reactors, co2_cmd, air_cmd, air_mfc, co2_mfc, no_mfc):
+def failsafe_outputs_all(reactors, rstate, air_mfc, co2_mfc, no_mfc):
     """
     Global failsafe:
     All reactors → CO₂ = 0, AIR = 0
     """
     for r in reactors:
         apply_safe_outputs_for_reactor(
-            r, co2_cmd, air_cmd, air_mfc, co2_mfc, no_mfc
+            r, rstate, air_mfc, co2_mfc, no_mfc
         )
 
 # ============================================================
@@ -153,8 +410,77 @@ def close_mm44_all(mm44_list):
             s.close()
         except Exception:
             pass
+        _rx_buf.pop(s, None)
     return []
 
+# Per-port receive buffers for the chunked reader. A partial frame
+# stays buffered across ticks instead of stalling in readline until
+# the terminator (or the timeout) arrives.
+_rx_buf = {}
+
+def _drain_mm44_port(ser, max_lines):
+    """
+    Drain whatever the port has pending in one read() and return the
+    complete newline-terminated frames, newest last.
+    """
+    buf = _rx_buf.get(ser)
+    if buf is None:
+        buf = _rx_buf[ser] = bytearray()
+
+    n = ser.in_waiting
+    if n:
+        buf += ser.read(n)
+
+    if b"\n" not in buf:
+        return []
+
+    *frames, rest = buf.split(b"\n")
+    _rx_buf[ser] = bytearray(rest)
+
+    lines = []
+    for frame in frames[-max_lines:]:
+        raw = frame.decode(errors="ignore").strip()
+        if raw:
+            lines.append(raw)
+    return lines
+
+# One worker thread per MM44 port. pyserial releases the GIL while
+# blocked in read(), so both FTDI streams drain in parallel and the
+# worst-case wait is one port's timeout budget, not the sum.
+_mm44_pool = None
+
+def read_mm44_all(mm44_list, max_lines=6):
+    """
+    Drain all MM44 ports concurrently.
+    Returns ({port_idx: [line, ...]}, ok) where ok is False if any
+    port raised during the read.
+    """
+    global _mm44_pool
+
+    lines_by_port = {}
+    ok = True
+
+    if not mm44_list:
+        return lines_by_port, ok
+
+    if _mm44_pool is None:
+        _mm44_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(mm44_list), thread_name_prefix="mm44"
+        )
+
+    futures = {
+        idx: _mm44_pool.submit(_drain_mm44_port, ser, max_lines)
+        for idx, ser in enumerate(mm44_list)
+    }
+
+    for idx, fut in futures.items():
+        try:
+            lines_by_port[idx] = fut.result()
+        except Exception:
+            ok = False
+
+    return lines_by_port, ok
+
 def open_mm44_all(mm44_ports):
     mm44_list = []
     ok = True
@@ -24,8 +24,12 @@ import select
 import argparse
 import json
 import struct
+import re
 import os
 import csv
+import threading
+import queue
+import concurrent.futures
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -37,6 +41,18 @@ from pathlib import Path
 import serial
 import minimalmodbus
 
+# Optional: orjson serializes the dashboard payload several times
+# faster than stdlib json and emits bytes directly. Fall back to the
+# stdlib transparently when it is not installed.
+try:
+    import orjson
+
+    def dumps_bytes(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    def dumps_bytes(obj):
+        return json.dumps(obj).encode()
+
 # ============================================================
 # Defaults – hardware & serial
 # ============================================================
@@ -53,6 +69,11 @@ MM44_TIMEOUT = 0.15
 MFC_BAUD = 9600
 MFC_TIMEOUT = 0.6
 
+# Skip rewriting a setpoint that has moved less than this (%FS), but
+# force a full refresh periodically in case an MFC was power-cycled.
+MFC_WRITE_EPS = 0.05
+MFC_REFRESH_S = 30.0
+
 # Modbus float word order (instrument-specific)
 WORD_ORDER = "hi_lo"
 
@@ -117,6 +138,19 @@ class ReactorCfg:
     ph_sp: float
     air_baseline: float
 
+    def __post_init__(self):
+        # Normalize channel names once so lookups skip str.upper()
+        self.ph_ch = self.ph_ch.upper()
+        self.do_ch = self.do_ch.upper()
+
+        # Alarm keys are fixed per reactor; build them once here
+        # instead of re-formatting f-strings every validation pass.
+        self.ph_stale_key = f"{self.name}_PH_STALE"
+        self.ph_missing_key = f"MAP_CH_MISSING_{self.name}_PH"
+        self.ph_mismatch_key = f"MAP_TYPE_MISMATCH_{self.name}_PH"
+        self.do_missing_key = f"MAP_CH_MISSING_{self.name}_DO"
+        self.do_mismatch_key = f"MAP_TYPE_MISMATCH_{self.name}_DO"
+
 
 REACTORS_DEFAULT = [
     ReactorCfg("R1", True,  0, "C1", 1, "C2", 1, 2, 7.40, 20.0),
@@ -132,12 +166,9 @@ def clamp(x, lo, hi):
     return max(lo, min(hi, x))
 
 def rate_limit(new, old, max_delta):
-    delta = new - old
-    if delta > max_delta:
-        return old + max_delta
-    if delta < -max_delta:
-        return old - max_delta
-    return new
+    # Branchless form (like clamp): the step is just the delta clamped
+    # to ±max_delta, with no data-dependent branches on the pH path.
+    return old + max(-max_delta, min(max_delta, new - old))
 
 def now_iso():
     return datetime.now().isoformat(timespec="seconds")
@@ -152,6 +183,34 @@ def safe_float(x):
 # PID controller
 # ============================================================
 
+def _mk_pid_update(kp, ki, kd, kt, out_min, out_max, state):
+    """
+    Build an update closure with the (fixed) gains and limits bound
+    as locals, so the per-tick call does no self.* attribute loads.
+    state is the mutable [integrator, prev_err] pair.
+    """
+
+    def update(pv, sp, dt):
+        err = pv - sp
+
+        d_term = 0.0
+        prev = state[1]
+        if prev is not None and dt > 0:
+            d_term = (err - prev) / dt
+        state[1] = err
+
+        u_unsat = kp * err + ki * state[0] + kd * d_term
+        u = max(out_min, min(out_max, u_unsat))
+
+        # Back-calculation: while the output saturates, bleed the
+        # integrator toward the saturation point instead of letting
+        # it wind up and delay recovery once pH swings back.
+        state[0] += dt * (err - kt * (u_unsat - u))
+
+        return u
+
+    return update
+
 class PID:
     """
     Error definition:
@@ -159,6 +218,9 @@ class PID:
 
     +err → pH too high → inject CO₂
     -err → pH too low  → boost AIR (split-range mode)
+
+    The gains are fixed for the life of the controller, so update is
+    a specialized closure from _mk_pid_update rather than a method.
     """
 
     def __init__(self, kp, ki, kd, out_min, out_max):
@@ -168,57 +230,146 @@ class PID:
         self.out_min = out_min
         self.out_max = out_max
 
-        self.integrator = 0.0
-        self.prev_err = None
+        # Tracking anti-windup gain (back-calculation), Kt = 2/Kp
+        self.kt = 2.0 / kp if kp else 0.0
+
+        # [integrator, prev_err], shared with the update closure
+        self._state = [0.0, None]
+        self.update = _mk_pid_update(
+            kp, ki, kd, self.kt, out_min, out_max, self._state
+        )
 
     def reset(self):
-        self.integrator = 0.0
-        self.prev_err = None
+        self._state[0] = 0.0
+        self._state[1] = None
 
-    def update(self, pv, sp, dt):
-        err = pv - sp
+# ============================================================
+# Reactor control state (struct-of-arrays)
+# ============================================================
 
-        d_term = 0.0
-        if self.prev_err is not None and dt > 0:
-            d_term = (err - self.prev_err) / dt
-        self.prev_err = err
+class ReactorState:
+    """
+    Per-reactor control state laid out as parallel arrays indexed by
+    reactor position instead of dicts keyed by reactor name.
 
-        self.integrator += err * dt
-        self.integrator = clamp(self.integrator, -1000.0, 1000.0)
+    The RUN step then runs as tight index loops over flat arrays —
+    no per-name dict lookups, no per-reactor object allocation — and
+    the layout maps 1:1 onto NumPy vectors should the reactor count
+    ever outgrow plain Python loops.
+    """
 
-        control_signal = (
-            self.kp * err +
-            self.ki * self.integrator +
-            self.kd * d_term
-        )
+    def __init__(self, reactors, kp, ki, kd, out_min, out_max):
+        n = len(reactors)
+
+        self.names = [r.name for r in reactors]
+        self.index = {r.name: i for i, r in enumerate(reactors)}
+
+        self.sp = [r.ph_sp for r in reactors]
+        self.air_baseline = [r.air_baseline for r in reactors]
+        self.enabled = [r.enabled for r in reactors]
+
+        self.ph = [None] * n
+        self.stale = [False] * n
+        self.last_ph_time = [0.0] * n
+
+        self.co2_cmd = [0.0] * n
+        self.air_cmd = [r.air_baseline for r in reactors]
+        self.co2_flow = [None] * n
+
+        # Shared PID gains, per-reactor integrator/history
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.out_min = out_min
+        self.out_max = out_max
 
-        return clamp(control_signal, self.out_min, self.out_max)
+        # Tracking anti-windup gain (back-calculation), Kt = 2/Kp
+        self.kt = 2.0 / kp if kp else 0.0
+
+        self.integrator = [0.0] * n
+        self.prev_err = [0.0] * n
+        self.has_prev = [False] * n
+
+    def reset_pid(self, i):
+        self.integrator[i] = 0.0
+        self.prev_err[i] = 0.0
+        self.has_prev[i] = False
+
+    def reset_pid_all(self):
+        for i in range(len(self.names)):
+            self.reset_pid(i)
+
+
+def run_step(ph, sp, enabled, stale, deadband, mode_split,
+             kp, ki, kd, kt, out_min, out_max,
+             air_baseline, integrator, prev_err, has_prev,
+             co2_cmd, air_cmd, co2_step, air_step, dt,
+             co2_min, co2_max, air_min, air_max):
+    """
+    One fused control step over all reactors: deadband check, PID with
+    back-calculation anti-windup, split-range mode selection, clamping
+    and rate limiting, in a single pass over the state arrays.
+
+    Mutates integrator/prev_err/has_prev and co2_cmd/air_cmd in place;
+    disabled, stale and unmeasured reactors are left untouched. Written
+    as scalar loops over flat arrays so it could be handed to a JIT
+    compiler unchanged if the reactor count ever demands it.
+    """
+    for i in range(len(ph)):
+        pv = ph[i]
+        if pv is None or not enabled[i] or stale[i]:
+            continue
+
+        err = pv - sp[i]
+
+        u = 0.0
+        if abs(err) > deadband:
+            d_term = 0.0
+            if has_prev[i] and dt > 0:
+                d_term = (err - prev_err[i]) / dt
+            prev_err[i] = err
+            has_prev[i] = True
+
+            u_unsat = kp * err + ki * integrator[i] + kd * d_term
+            u = max(out_min, min(out_max, u_unsat))
+
+            # Back-calculation: while the output saturates, bleed the
+            # integrator toward the saturation point instead of letting
+            # it wind up and delay recovery once pH swings back.
+            integrator[i] += dt * (err - kt * (u_unsat - u))
+
+        if mode_split and u < 0:
+            target_co2 = 0.0
+            target_air = max(air_min, min(air_max, air_baseline[i] - u))
+        else:
+            target_co2 = max(co2_min, min(co2_max, u))
+            target_air = air_baseline[i]
+
+        co2_cmd[i] += max(-co2_step, min(co2_step, target_co2 - co2_cmd[i]))
+        air_cmd[i] += max(-air_step, min(air_step, target_air - air_cmd[i]))
 
 # ============================================================
 # MM44 parsing
 # ============================================================
 
-def parse_mm44_line(line: str):
-    parts = [p.strip() for p in line.split(";")]
-    parsed = {}
-
-    def is_channel(tok):
-        return tok.startswith("C") and len(tok) == 2 and tok[1].isdigit()
+# Tokenization runs in the C regex engine instead of per-token Python
+# string ops (split / strip / startswith / isdigit per field). The
+# value field is captured raw: a non-numeric reading (ERR, ---, empty)
+# must still overwrite the channel with value None, because that None
+# is what stops the last_ph_time refresh and trips the stale-pH
+# failsafe once the transmitter goes bad.
+_MM44_RE = re.compile(r"(C\d)\s*;\s*(PH|DO|OD)\s*;\s*([^;]*)", re.IGNORECASE)
 
-    i = 0
-    while i < len(parts):
-        if is_channel(parts[i]) and i + 2 < len(parts):
-            ch = parts[i]
-            kind = parts[i + 1].upper()
-            value = safe_float(parts[i + 2])
-
-            if kind in ("PH", "DO", "OD"):
-                parsed[ch] = {
-                    "type": "pH" if kind == "PH" else "DO",
-                    "value": value,
-                }
-        i += 1
+def parse_mm44_line(line):
+    if isinstance(line, bytes):
+        line = line.decode(errors="ignore")
 
+    parsed = {}
+    for ch, kind, value in _MM44_RE.findall(line):
+        parsed[ch.upper()] = {
+            "type": "pH" if kind.upper() == "PH" else "DO",
+            "value": safe_float(value),
+        }
     return parsed
 
 # ============================================================
@@ -233,14 +384,17 @@ def make_mfc(port, addr):
     inst.close_port_after_each_call = True
     return inst
 
+# Precompiled packers: skip format-string parsing on every transaction.
+_F32 = struct.Struct(">f")
+_HH = struct.Struct(">HH")
+
 def write_f32(inst, reg, value):
-    raw = struct.pack(">f", float(value))
-    hi, lo = struct.unpack(">HH", raw)
+    hi, lo = _HH.unpack(_F32.pack(float(value)))
     inst.write_registers(reg, [hi, lo])
 
 def read_f32(inst, reg):
     hi, lo = inst.read_registers(reg, 2)
-    return struct.unpack(">f", struct.pack(">HH", hi, lo))[0]
+    return _F32.unpack(_HH.pack(hi, lo))[0]
 
 # ============================================================
 # Main application